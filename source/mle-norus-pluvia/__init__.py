@@ -6,15 +6,48 @@ __email__ = 'miguel.couy@outlook.com'
 __status__ = 'Production'
 
 import os
+import shutil
+import asyncio
+import weakref
 import datetime as dt
 from datetime import timezone
 
 from pathlib import Path
-import json
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal, Optional
 import pandas as pd
 from urllib.error import HTTPError
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = partial(orjson.dumps, option = orjson.OPT_INDENT_2)
+
+except ImportError:
+    import json as orjson_compat
+
+    JSON_DECODER = orjson_compat.JSONDecoder()
+    JSON_ENCODER = orjson_compat.JSONEncoder(indent = 2)
+
+    def json_loads(content: bytes):
+        if isinstance(content, (bytes, bytearray)):
+            content = content.decode()
+
+        return JSON_DECODER.decode(content)
+
+    def json_dumps(obj) -> bytes:
+        return JSON_ENCODER.encode(obj).encode()
 
 from settings import (
     settings, FILES, PRECIPITATION_SOURCES, FORECAST_MODELS, MODES
@@ -28,18 +61,67 @@ GLOBAL_CONFIG: dict = SCRIPT_CONFIG['global_config']
 
 TOKEN_FILEPATH = Path(SCRIPT_DIR, '.pluvia')
 BASE_URL = 'https://api.pluvia.app'
+MODES_ENDPOINT = '/v2/valoresParametros/modos'
+PRECIPITATION_SOURCES_ENDPOINT = '/v2/valoresParametros/mapas'
+FORECAST_MODELS_ENDPOINT = '/v2/valoresParametros/modelos'
+TOKEN_EXPIRATION_MARGIN = dt.timedelta(seconds = 30)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 DATA_FOLDERPATH = Path(SCRIPT_DIR, 'data')
 os.makedirs(DATA_FOLDERPATH, exist_ok = True)
 
+RETRY_POLICY = Retry(
+    total = 5,
+    backoff_factor = 0.5,
+    status_forcelist = [429, 500, 502, 503, 504],
+    allowed_methods = ['GET', 'POST'],
+    respect_retry_after_header = True,
+    raise_on_status = False
+)
+
+SESSION = requests.Session()
+SESSION.headers.update({
+    'Accept': '*/*',
+    'Accept-Encoding': requests.utils.DEFAULT_ACCEPT_ENCODING
+})
+SESSION.mount(
+    'https://',
+    HTTPAdapter(
+        pool_connections = 10,
+        pool_maxsize = 10,
+        max_retries = RETRY_POLICY
+    )
+)
+
+ASYNC_TOKEN_LOCKS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+ASYNC_ID_INDEXES: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
 
 access_token: dict = None
+auth_headers: dict = None
 login_data: dict = None
+token_expires_at: dt.datetime = None
+token_source: Path = None
 
 
 # ----------------------------------------------------------------------
 # Client authentication function | Função de autenticação do cliente
 # ----------------------------------------------------------------------
+def token_is_fresh() -> bool:
+    """
+    This function checks if a token is held in memory and is not within
+    TOKEN_EXPIRATION_MARGIN of expiring.
+
+    Returns:
+        bool: True if the cached token can still be used, otherwise False.
+    """
+    return bool(
+        access_token
+        and token_expires_at
+        and token_expires_at - TOKEN_EXPIRATION_MARGIN
+            > dt.datetime.now(timezone.utc)
+    )
+
 def authenticate(
         _username: Optional[str] = None, 
         _password: Optional[str] = None,
@@ -53,6 +135,10 @@ def authenticate(
     This function authenticates a user by either finding a valid token in the
     specified file or refreshing it if necessary. It uses provided credentials
     or data to obtain a new token if the existing one is invalid or expired.
+    A token already held in memory is reused without touching the file or the
+    API until it is about to expire, as long as the same credentials and
+    token file are requested. In that case `headers` and `verify` are not
+    used, since they only apply when a new token is requested from the API.
 
     Parameters:
     - `_username` (Optional[str]): The username for authentication.
@@ -72,28 +158,41 @@ def authenticate(
         dict[str]: A dictionary containing the token data.
     """
 
+    global access_token
+    global auth_headers
+    global login_data
+    global token_expires_at
+    global token_source
+
+    if not token_filepath:
+        token_filepath = TOKEN_FILEPATH
+
     if not _data and _username and _password:
         _data = {
             'username': _username,
             'password': _password
         } 
 
-    if not headers:
+    if (
+        token_is_fresh()
+        and (not _data or _data == login_data)
+        and token_filepath == token_source
+    ):
+        return
+
+    if headers is None:
         headers = {
-            'content-type': 'application/json',
-            'accept': '*/*'
+            'content-type': 'application/json'
         }
 
-    if not verify:
+    if verify is None:
         verify = True
 
-    if not token_filepath:
-        token_filepath = TOKEN_FILEPATH
-
     def find_token(token_filepath: Path) -> Optional[dict]:
         """
         This function checks if the token specified file exists. If it does, it
-        reads the content and loads it as a dictionary using the `json` module.
+        reads the content and loads it as a dictionary using `orjson` (or the
+        standard `json` module when `orjson` is not installed).
 
         Parameters:
         - `token_filepath` (Path): The path to the JSON file containing the
@@ -106,15 +205,32 @@ def authenticate(
         token_data: dict = None
 
         if token_filepath.exists():
-            with open(token_filepath, '+r') as file:
-                token_data: dict = json.loads(file.read())
+            with open(token_filepath, 'rb') as file:
+                token_data: dict = json_loads(file.read())
 
         return token_data
+
+    def get_expiration_date(token: dict) -> dt.datetime:
+        """
+        This function parses the expiration date of the provided token.
+
+        Parameters:
+        - `token` (dict): A dictionary containing the token data, which
+          includes an 'expires' field with the expiration date in the format
+          '%Y-%m-%dT%H:%M:%SZ'.
+
+        Returns:
+            dt.datetime: The timezone-aware (UTC) expiration date.
+        """
+        return dt.datetime.fromisoformat(
+            token['expires'].replace('Z', '+00:00')
+        )
     
     def is_valid_token(token: Optional[dict]) -> bool:
         """
         This function checks if the provided token is valid. It compares the 
-        token's expiration date with the current date and time.
+        token's expiration date, minus TOKEN_EXPIRATION_MARGIN, with the
+        current date and time.
 
         Parameters:
         - `token` (Optional[dict]): A dictionary containing the token data, 
@@ -126,9 +242,7 @@ def authenticate(
             the future), otherwise False.
         """
         if token:
-            dt_to_expire = dt.datetime.strptime(
-                token['expires'], '%Y-%m-%dT%H:%M:%SZ'
-            ).replace(tzinfo = timezone.utc)
+            dt_to_expire = get_expiration_date(token) - TOKEN_EXPIRATION_MARGIN
 
             dt_now = dt.datetime.now(timezone.utc)
 
@@ -162,16 +276,18 @@ def authenticate(
     
         endpoint = '/v2/token'
 
-        resp_token = requests.post(
+        # Drop the session's bearer header so a stale (or another user's)
+        # token is never sent to the token endpoint.
+        resp_token = SESSION.post(
             url = BASE_URL + endpoint, 
-            headers = headers, 
+            headers = {**headers, 'Authorization': None}, 
             json = _data,
             verify = verify
         )
         
         resp_token.raise_for_status()
 
-        token = json.loads(resp_token.content)
+        token = json_loads(resp_token.content)
 
         return token
 
@@ -191,11 +307,8 @@ def authenticate(
         Returns:
             None
         """
-        with open(token_filepath, mode = '+w') as file:
-            json.dump(token, file, indent = 4)
-
-    global access_token
-    global login_data
+        with open(token_filepath, mode = 'wb') as file:
+            file.write(json_dumps(token))
 
     token = find_token(
         token_filepath = token_filepath
@@ -215,6 +328,27 @@ def authenticate(
 
     access_token = token['access_token']
     login_data = _data
+    token_expires_at = get_expiration_date(token)
+    token_source = token_filepath
+
+    auth_headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json'
+    }
+
+    SESSION.headers.update(auth_headers)
+
+def ensure_token() -> None:
+    """
+    This function makes sure a valid token is held in memory. It only calls
+    `authenticate` (and thus touches the token file or the API) when there is
+    no cached token or it is within TOKEN_EXPIRATION_MARGIN of expiring.
+
+    Returns:
+        None
+    """
+    if not token_is_fresh():
+        authenticate(_data = login_data, token_filepath = token_source)
 
 
 # ----------------------------------------------------------------------
@@ -225,30 +359,43 @@ def request_info_from_api(
         headers: Optional[dict] = None, 
         verify: Optional[bool] = None
         ) -> Optional[dict]:
-    
-    authenticate(_data = login_data)
+    """
+    This function sends a GET request to the specified endpoint and parses
+    the JSON body. The body is buffered eagerly and parsed straight from the
+    response bytes, without decoding it to text first.
+
+    Parameters:
+    - `endpoint` (str): The API endpoint to request.
+    - `headers` (Optional[dict]): Extra headers merged on top of the session
+      headers. Defaults to None.
+    - `verify` (Optional[bool]): A boolean indicating whether to verify the
+      server's TLS certificate. Defaults to True.
+
+    Returns:
+        Optional[dict]: The parsed JSON body, or None if no endpoint is given
+        or the response has no content.
+    """
+    ensure_token()
     
     if not endpoint:
         return None
     
-    if not headers:
-        headers = {
-            'Authorization': 'Bearer ' + access_token,
-            "Content-Type": "application/json"
-        }
-    
-    if not verify:
+    if verify is None:
         verify = True
 
-    response = requests.get(
+    response = SESSION.get(
         url = BASE_URL + endpoint, 
         headers = headers, 
-        verify = verify
+        verify = verify,
+        stream = False
     )
     
     response.raise_for_status()
 
-    return json.loads(response.content)
+    if response.status_code == 204 or not response.content:
+        return None
+
+    return json_loads(response.content)
 
 def request_file_from_api(
         endpoint: str = None,
@@ -259,32 +406,36 @@ def request_file_from_api(
         filepath: Optional[Path] = None
         ) -> None:
     
-    authenticate(_data = login_data)
+    ensure_token()
     
     if not endpoint:
         return None
     
-    if not headers:
-        headers = {
-            'Authorization': 'Bearer ' + access_token,
-            "Content-Type": "application/json"
-        }
-    
-    if not verify:
+    if verify is None:
         verify = True
     
-    response = requests.get(
+    with SESSION.get(
         url = BASE_URL + endpoint,
         headers = headers,
-        verify = True
-    )
+        verify = verify,
+        stream = True
+    ) as response:
 
-    response.raise_for_status()
+        response.raise_for_status()
+
+        if (
+            response.status_code == 204
+            or response.headers.get('Content-Length') == '0'
+        ):
+            return None
 
-    if save_it:
-        with open(Path(filepath, filename), 'wb') as file:
-            for chunk in response.iter_content(chunk_size = 1024):
-                file.write(chunk)
+        if save_it:
+            response.raw.decode_content = True
+
+            with open(Path(filepath, filename), 'wb') as file:
+                shutil.copyfileobj(
+                    response.raw, file, length = DOWNLOAD_CHUNK_SIZE
+                )
 
 
 # ----------------------------------------------------------------------
@@ -303,8 +454,42 @@ def get_id(this_name: str, list_dict: list[dict]) -> str:
     """
     return next(i['id'] for i in list_dict if i['descricao'] == this_name)
 
+@lru_cache(maxsize = 16)
 def fetch_ids(endpoint: str) -> list[dict]:
-    return request_info_from_api(endpoint=endpoint)
+    """
+    Fetch the list of parameter values from the specified endpoint. Results
+    are cached per endpoint; call `clear_id_cache()` to refresh them.
+
+    Parameters:
+    - `endpoint` (str): The API endpoint to fetch data from.
+
+    Returns:
+        list[dict]: The list of dictionaries returned by the API.
+
+    Raises:
+        ValueError: If the API returns no content. The error is not cached,
+        so the next call requests the endpoint again.
+    """
+    list_dict = request_info_from_api(endpoint=endpoint)
+
+    if list_dict is None:
+        raise ValueError(f'No content returned by the {endpoint} endpoint.')
+
+    return list_dict
+
+@lru_cache(maxsize = 16)
+def fetch_id_index(endpoint: str) -> dict[str, str]:
+    """
+    Build a lookup table of IDs keyed by the 'descricao' key from the data
+    fetched at the specified endpoint.
+
+    Parameters:
+    - `endpoint` (str): The API endpoint to fetch data from.
+
+    Returns:
+        dict[str, str]: A dictionary mapping each description to its ID.
+    """
+    return {i['descricao']: i['id'] for i in fetch_ids(endpoint)}
 
 def get_id_of_item(item_name: str, endpoint: str) -> str:
     """
@@ -316,19 +501,338 @@ def get_id_of_item(item_name: str, endpoint: str) -> str:
 
     Returns:
         str: The ID of the specified item.
+
+    Raises:
+        KeyError: If no item with the given name is found.
     """
-    return get_id(item_name, fetch_ids(endpoint))
+    return fetch_id_index(endpoint)[item_name]
 
+@lru_cache(maxsize = None)
 def get_id_of_mode(mode: MODES) -> str:
-    return get_id_of_item(mode, '/v2/valoresParametros/modos')
+    return get_id_of_item(mode, MODES_ENDPOINT)
 
+@lru_cache(maxsize = None)
 def get_id_of_precipitation_source(precipitation_source: PRECIPITATION_SOURCES) -> str:
-    return get_id_of_item(precipitation_source, '/v2/valoresParametros/mapas')
+    return get_id_of_item(precipitation_source, PRECIPITATION_SOURCES_ENDPOINT)
 
+@lru_cache(maxsize = None)
 def get_id_of_forecast_model(forecast_model: FORECAST_MODELS) -> str:
-    return get_id_of_item(forecast_model, '/v2/valoresParametros/modelos')
+    return get_id_of_item(forecast_model, FORECAST_MODELS_ENDPOINT)
+
+def prefetch_ids(
+        modes: tuple[MODES, ...] = (),
+        precipitation_sources: tuple[PRECIPITATION_SOURCES, ...] = (),
+        forecast_models: tuple[FORECAST_MODELS, ...] = (),
+        max_workers: int = 4
+        ) -> dict[str, dict[str, str]]:
+    """
+    Retrieve the IDs of several modes, precipitation sources and forecast
+    models at once. The endpoints involved are fetched concurrently and the
+    results populate the ID caches used by the `get_id_of_*` functions.
+
+    Parameters:
+    - `modes` (tuple[MODES, ...]): The modes to retrieve the IDs for.
+    - `precipitation_sources` (tuple[PRECIPITATION_SOURCES, ...]): The
+      precipitation sources to retrieve the IDs for.
+    - `forecast_models` (tuple[FORECAST_MODELS, ...]): The forecast models
+      to retrieve the IDs for.
+    - `max_workers` (int): The maximum number of concurrent requests.
+      Defaults to 4.
+
+    Returns:
+        dict[str, dict[str, str]]: A dictionary with the 'modes',
+        'precipitation_sources' and 'forecast_models' keys, each mapping the
+        requested names to their IDs.
+    """
+    lookups = (
+        ('modes', get_id_of_mode, 
+         MODES_ENDPOINT, modes),
+        ('precipitation_sources', get_id_of_precipitation_source, 
+         PRECIPITATION_SOURCES_ENDPOINT, precipitation_sources),
+        ('forecast_models', get_id_of_forecast_model, 
+         FORECAST_MODELS_ENDPOINT, forecast_models)
+    )
+
+    ensure_token()
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [
+            executor.submit(fetch_id_index, endpoint)
+            for _, _, endpoint, items in lookups if items
+        ]
+
+        for future in futures:
+            future.result()
+
+    return {
+        name: {item: get_id_of(item) for item in items}
+        for name, get_id_of, _, items in lookups
+    }
+
+def clear_id_cache() -> None:
+    """
+    Clear the cached parameter values and IDs so the next lookups hit the API.
+    """
+    fetch_ids.cache_clear()
+    fetch_id_index.cache_clear()
+    get_id_of_mode.cache_clear()
+    get_id_of_precipitation_source.cache_clear()
+    get_id_of_forecast_model.cache_clear()
+    ASYNC_ID_INDEXES.clear()
+
+
+# ----------------------------------------------------------------------
+# Asynchronous requisition functions | Funções de requisições assíncronas
+# ----------------------------------------------------------------------
+async def create_async_session(
+        limit: int = 20,
+        keepalive_timeout: float = 75,
+        verify: Optional[bool] = None
+        ) -> 'aiohttp.ClientSession':
+    """
+    Create an `aiohttp.ClientSession` backed by a single pooled connector,
+    meant to be shared by every asynchronous request of a pipeline. The
+    connector is bound to the running event loop, so this is a coroutine:
+    `session = await create_async_session()` from inside the pipeline.
+
+    Parameters:
+    - `limit` (int): The maximum number of simultaneous connections.
+      Defaults to 20.
+    - `keepalive_timeout` (float): The number of seconds an idle connection
+      is kept open. Defaults to 75.
+    - `verify` (Optional[bool]): A boolean indicating whether to verify the
+      server's TLS certificate. Defaults to True.
+
+    Returns:
+        aiohttp.ClientSession: The session. Must be closed by the caller.
+
+    Raises:
+        ImportError: If `aiohttp` is not installed.
+    """
+    if aiohttp is None:
+        raise ImportError(
+            'aiohttp is required for the asynchronous request functions.'
+        )
+
+    if verify is None:
+        verify = True
+
+    return aiohttp.ClientSession(
+        connector = aiohttp.TCPConnector(
+            limit = limit,
+            keepalive_timeout = keepalive_timeout,
+            ssl = verify
+        )
+    )
+
+async def aensure_token() -> None:
+    """
+    Asynchronous counterpart of `ensure_token`. A token refresh runs in a
+    worker thread so it does not block the event loop, and a per-loop lock
+    makes concurrent coroutines wait for a single refresh.
+
+    Returns:
+        None
+    """
+    if token_is_fresh():
+        return
+
+    lock = ASYNC_TOKEN_LOCKS.setdefault(
+        asyncio.get_running_loop(), asyncio.Lock()
+    )
+
+    async with lock:
+        if not token_is_fresh():
+            await asyncio.to_thread(ensure_token)
+
+def get_retry_delay(retry: Retry, response: 'aiohttp.ClientResponse') -> float:
+    """
+    Compute how long to wait before retrying a request, the same way
+    `Retry.sleep` does for the synchronous session: the response's
+    Retry-After header (in seconds or as an HTTP date) when the policy
+    respects it, otherwise the policy's backoff time, capped at its
+    `backoff_max`.
+
+    Parameters:
+    - `retry` (Retry): The retry state after the failed attempt.
+    - `response` (aiohttp.ClientResponse): The response to be retried.
+
+    Returns:
+        float: The number of seconds to wait.
+    """
+    if retry.respect_retry_after_header:
+        retry_after = retry.get_retry_after(response)
+
+        if retry_after:
+            return retry_after
+
+    return retry.get_backoff_time()
+
+async def afetch_ids(
+        endpoint: str,
+        session: 'aiohttp.ClientSession',
+        retries: Optional[int] = None
+        ) -> Optional[list[dict]]:
+    """
+    Asynchronously fetch the list of parameter values from the specified
+    endpoint. Responses are retried following RETRY_POLICY, with the same
+    statuses, Retry-After handling and backoff as the synchronous session;
+    connection errors are not retried. TLS verification is configured on
+    the session through `create_async_session`.
+
+    Parameters:
+    - `endpoint` (str): The API endpoint to fetch data from.
+    - `session` (aiohttp.ClientSession): The session to send the request
+      with, as returned by `create_async_session`.
+    - `retries` (Optional[int]): The maximum number of retries. Defaults to
+      RETRY_POLICY's total.
+
+    Returns:
+        Optional[list[dict]]: The list of dictionaries returned by the API,
+        or None if the response has no content.
+
+    Raises:
+        aiohttp.ClientResponseError: If the request fails.
+    """
+    await aensure_token()
+
+    retry = RETRY_POLICY
+
+    if retries is not None:
+        retry = RETRY_POLICY.new(total = retries)
+
+    while True:
+        delay = None
+
+        async with session.get(
+            BASE_URL + endpoint, headers = auth_headers
+        ) as response:
+
+            if retry.is_retry(
+                'GET', response.status, 'Retry-After' in response.headers
+            ):
+                try:
+                    retry = retry.increment(
+                        method = 'GET', url = BASE_URL + endpoint
+                    )
+                    delay = get_retry_delay(retry, response)
+
+                except MaxRetryError:
+                    pass
+
+            if delay is None:
+                response.raise_for_status()
+
+                content = await response.read()
+
+                if response.status == 204 or not content:
+                    return None
+
+                return json_loads(content)
+
+        await asyncio.sleep(delay)
+
+async def afetch_id_index(
+        endpoint: str,
+        session: 'aiohttp.ClientSession'
+        ) -> dict[str, str]:
+    """
+    Asynchronous counterpart of `fetch_id_index`. The index of each endpoint
+    is fetched once per event loop: concurrent and later callers await the
+    same task instead of sending their own request. Failures are not cached,
+    so the next call requests the endpoint again.
+
+    Parameters:
+    - `endpoint` (str): The API endpoint to fetch data from.
+    - `session` (aiohttp.ClientSession): The session to send the request
+      with, as returned by `create_async_session`.
+
+    Returns:
+        dict[str, str]: A dictionary mapping each description to its ID.
+
+    Raises:
+        ValueError: If the API returns no content.
+    """
+    async def build_id_index() -> dict[str, str]:
+        list_dict = await afetch_ids(endpoint, session)
+
+        if list_dict is None:
+            raise ValueError(
+                f'No content returned by the {endpoint} endpoint.'
+            )
+
+        return {i['descricao']: i['id'] for i in list_dict}
+
+    tasks: dict = ASYNC_ID_INDEXES.setdefault(asyncio.get_running_loop(), {})
+
+    if endpoint not in tasks:
+        tasks[endpoint] = asyncio.ensure_future(build_id_index())
+
+    task = tasks[endpoint]
+
+    try:
+        return await asyncio.shield(task)
+
+    except Exception:
+        if tasks.get(endpoint) is task:
+            del tasks[endpoint]
+
+        raise
+
+async def aget_id_of_item(
+        item_name: str,
+        endpoint: str,
+        session: 'aiohttp.ClientSession'
+        ) -> str:
+    """
+    Asynchronously retrieve the ID of a specific item from the specified
+    endpoint.
+
+    Parameters:
+    - `item_name` (str): The name of the item to retrieve the ID for.
+    - `endpoint` (str): The API endpoint to fetch data from.
+    - `session` (aiohttp.ClientSession): The session to send the request
+      with, as returned by `create_async_session`.
+
+    Returns:
+        str: The ID of the specified item.
+
+    Raises:
+        KeyError: If no item with the given name is found.
+        ValueError: If the API returns no content.
+    """
+    return (await afetch_id_index(endpoint, session))[item_name]
+
+
+# ----------------------------------------------------------------------
+# Script entry point | Ponto de entrada do script
+# ----------------------------------------------------------------------
+def main() -> None:
+    """
+    Authenticate with the credentials from the PLUVIA_USERNAME and
+    PLUVIA_PASSWORD environment variables and print the ID of the daily mode.
+    """
+    username = os.environ.get('PLUVIA_USERNAME')
+    password = os.environ.get('PLUVIA_PASSWORD')
+
+    missing = [
+        name for name, value in (
+            ('PLUVIA_USERNAME', username), ('PLUVIA_PASSWORD', password)
+        ) if not value
+    ]
+
+    if missing:
+        raise SystemExit(
+            'Missing environment variable(s): ' + ', '.join(missing)
+        )
+
+    authenticate(
+        _username = username,
+        _password = password
+    )
 
-authenticate(_username = 'miguel.couy', _password = '!Pluv14!')
+    print(get_id_of_mode(mode = 'Diário'))
 
 
-print(get_id_of_mode(mode = 'Diário'))
\ No newline at end of file
+if __name__ == '__main__':
+    main()